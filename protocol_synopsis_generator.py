@@ -1,14 +1,27 @@
-from typing import List, Dict, Optional, Union
-from pydantic import BaseModel
+from typing import List, Dict, Iterable, Iterator, Optional, Union, get_args, get_origin
+from types import MappingProxyType
+from pydantic import BaseModel, ConfigDict
 import os
-import json
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
 import logging
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, wraps
+import orjson
+import tiktoken
 from dotenv import load_dotenv
-from openai import OpenAI
-from pypdf import PdfReader
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, LengthFinishReasonError
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to the pure-Python reader
+    pdfium = None
+    from pypdf import PdfReader
+from docxtpl import DocxTemplate
 from datetime import datetime
 
 # Set up logging
@@ -18,6 +31,109 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+MODEL = "gpt-4o-mini"
+CONTEXT_WINDOW_TOKENS = 128000
+MAX_OUTPUT_TOKENS = 16384  # GPT-4o-mini's max output tokens
+# Headroom on top of the measured prompt and schema, for message framing, chunk
+# tags and the SDK's rewrite of the schema into strict form
+PROMPT_SAFETY_MARGIN_TOKENS = 512
+# Consecutive chunks share this many tokens so entities spanning a boundary aren't lost
+CHUNK_OVERLAP_TOKENS = 200
+# Small chunks are packed into shared requests, up to this many per request
+DEFAULT_MAX_CHUNKS_PER_REQUEST = 4
+
+# Word template rendered by save_to_word, with Jinja tags for every synopsis field
+WORD_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "protocol_template.docx")
+
+# Parsed chunk responses are cached here, keyed by a hash of the prompt inputs
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "catalyx", "responses.sqlite3")
+DEFAULT_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Fallback rate limits used when they can't be read from the API
+DEFAULT_MAX_REQUESTS_PER_MINUTE = 500
+DEFAULT_MAX_TOKENS_PER_MINUTE = 200000
+
+# Static instructions sent first in every request. Kept byte-identical across
+# chunks (no per-chunk interpolation) so OpenAI's automatic prompt caching can
+# reuse this prefix, which needs to be at least 1024 tokens long. The output
+# schema is enforced through structured outputs (ChunkExtractions) and is
+# cached as part of the same prefix.
+SYSTEM_PROMPT = """You are a clinical research expert tasked with extracting key information from a clinical trial protocol to create a synopsis.
+The input text is one or more sections of a larger protocol document, each starting with a <<<CHUNK n>>> tag.
+Extract relevant information from each chunk separately, following ICH guidelines.
+Focus on maintaining technical accuracy and precision. Return one extraction per chunk, in chunk order.
+
+When information is missing from a chunk:
+- Use empty string "" for missing string fields
+- Use empty array [] for missing array fields, or null where the field allows it
+- Use 0 for missing numeric fields
+For sponsor information, extract only the name as a string, not the full details.
+
+Field guidance:
+- protocol_title: the full official title as written on the title page, not an abbreviation.
+- short_title: the acronym or brief title used for the study; leave empty if none is given.
+- protocol_number: the sponsor's protocol identifier (not a registry number unless no other exists).
+- version_and_date: the protocol version or amendment number together with its date.
+- study_phase: the clinical development phase, e.g. "Phase 1", "Phase 2a", "Phase 3".
+- indication: the disease or condition under study, including stage or line of therapy where stated.
+- background: a short summary of the disease burden, unmet need and prior evidence motivating the study.
+- mechanism_of_action: how the investigational product acts, as described by the protocol.
+- justification_for_study_design: why the chosen design, comparator, dose and population were selected.
+- primary_objectives / secondary_objectives / exploratory_objectives: one objective per array item,
+  kept in the protocol's wording and order.
+- primary_endpoints / secondary_endpoints / exploratory_endpoints: one endpoint per array item,
+  including the timepoint or assessment window where stated.
+- design: the overall design, e.g. "randomized, double-blind, placebo-controlled, parallel-group".
+- arms: one object per treatment arm or cohort, including placebo and comparator arms.
+- blinding: who is blinded (open-label, single-blind, double-blind) and how the blind is maintained.
+- randomization: the allocation ratio, stratification factors and method, if randomized.
+- study_duration: the total duration of participation per participant.
+- target_population: a one-sentence description of who will be enrolled.
+- sample_size: the planned number of participants to be enrolled or randomized, as an integer.
+- inclusion_criteria / exclusion_criteria: one criterion per array item, in the protocol's numbering order.
+- investigational_product: the name and formulation of the study drug.
+- comparator: the active comparator or placebo, if any.
+- dosage_and_administration: one object per drug and regimen.
+- efficacy_assessments / safety_assessments / pharmacokinetic_assessments: the procedures and
+  measurements performed, one per array item.
+- immunogenicity_markers: anti-drug antibodies or other immune response measures, if collected.
+- sample_size_justification: the power calculation assumptions and resulting sample size rationale.
+- statistical_analysis_plan: the primary analysis method, analysis populations and handling of
+  missing data.
+- interim_analysis: the timing and purpose of any planned interim analyses.
+- ethical_considerations: informed consent, IRB/IEC review and other ethical safeguards.
+- data_monitoring: the data monitoring committee or other oversight arrangements.
+- estimated_study_start_date / estimated_study_completion_date: as stated in the protocol.
+- follow_up_duration: the length of follow-up after the last dose or end of treatment.
+
+Only extract information that is present in the text you are given. Do not infer or invent values.
+If the same information appears more than once, prefer the most specific and most recent statement.
+
+Extract all relevant information into a structured format following ICH guidelines,
+and return exactly one extraction per chunk."""
+
+# Built once and shared by every request so the prefix is the same object each time
+SYSTEM_MSG = ({"role": "system", "content": SYSTEM_PROMPT},)
+
+# The user message carries only the tagged chunks
+USER_TEMPLATE = """Chunks:
+{chunks}
+
+Return a JSON object with an "extractions" array holding one extraction per chunk."""
+
+@lru_cache(maxsize=None)
+def _get_encoding() -> tiktoken.Encoding:
+    """Return the tokenizer for MODEL, loaded on first use."""
+    return tiktoken.encoding_for_model(MODEL)
+
+def count_tokens(text: str) -> int:
+    """Count the tokens MODEL would see for the given text."""
+    return len(_get_encoding().encode(text))
+
+@lru_cache(maxsize=None)
+def _system_prompt_tokens() -> int:
+    return count_tokens(SYSTEM_PROMPT)
+
 class StudyArm(BaseModel):
     arm_name: str
     treatment_description: str
@@ -30,6 +146,9 @@ class DosageInfo(BaseModel):
     route_of_administration: str
 
 class ProtocolSynopsis(BaseModel):
+    # Immutable once built; unknown keys in extracted data are dropped
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     # Basic Study Information
     protocol_title: str
     short_title: str
@@ -47,10 +166,10 @@ class ProtocolSynopsis(BaseModel):
     # Objectives & Endpoints
     primary_objectives: List[str]
     secondary_objectives: List[str]
-    exploratory_objectives: Optional[List[str]]
+    exploratory_objectives: Optional[List[str]] = None
     primary_endpoints: List[str]
     secondary_endpoints: List[str]
-    exploratory_endpoints: Optional[List[str]]
+    exploratory_endpoints: Optional[List[str]] = None
 
     # Study Design
     design: str
@@ -67,19 +186,19 @@ class ProtocolSynopsis(BaseModel):
 
     # Treatments
     investigational_product: str
-    comparator: Optional[str]
+    comparator: Optional[str] = None
     dosage_and_administration: List[DosageInfo]
 
     # Assessments
     efficacy_assessments: List[str]
     safety_assessments: List[str]
-    pharmacokinetic_assessments: Optional[List[str]]
-    immunogenicity_markers: Optional[List[str]]
+    pharmacokinetic_assessments: Optional[List[str]] = None
+    immunogenicity_markers: Optional[List[str]] = None
 
     # Statistical Considerations
     sample_size_justification: str
     statistical_analysis_plan: str
-    interim_analysis: Optional[str]
+    interim_analysis: Optional[str] = None
 
     # Ethics & Compliance
     ethical_considerations: str
@@ -90,273 +209,473 @@ class ProtocolSynopsis(BaseModel):
     estimated_study_completion_date: str
     follow_up_duration: Union[str, int]
 
-class ProtocolSynopsisGenerator:
-    def __init__(self):
-        try:
-            self.client = OpenAI()
-            logger.info("OpenAI client initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing OpenAI client: {str(e)}")
-            raise
+class ChunkExtractions(BaseModel):
+    """Structured output for one request: one extraction per chunk, in order."""
+    extractions: List[ProtocolSynopsis]
 
-    def _read_pdf(self, pdf_path: str) -> str:
-        """Read PDF and extract text content."""
-        try:
-            reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-            logger.info(f"Successfully read PDF with {len(reader.pages)} pages")
-            return text
-        except Exception as e:
-            logger.error(f"Error reading PDF file: {str(e)}")
-            raise
+# Part of the response cache key, so schema changes invalidate cached responses
+_RESPONSE_SCHEMA = orjson.dumps(ChunkExtractions.model_json_schema(), option=orjson.OPT_SORT_KEYS).decode()
+
+@lru_cache(maxsize=None)
+def _input_token_budget() -> int:
+    """Largest amount of protocol text that fits in a single request, after the
+    system prompt, user template, response schema and the largest completion."""
+    overhead = (_system_prompt_tokens() + count_tokens(USER_TEMPLATE)
+                + count_tokens(_RESPONSE_SCHEMA) + PROMPT_SAFETY_MARGIN_TOKENS)
+    return CONTEXT_WINDOW_TOKENS - MAX_OUTPUT_TOKENS - overhead
+
+def _is_list_annotation(annotation, item_type=None) -> bool:
+    """True for List[X] and Optional[List[X]] annotations, restricted to
+    X == item_type if given."""
+    if get_origin(annotation) is Union:
+        return any(_is_list_annotation(arg, item_type) for arg in get_args(annotation))
+    return get_origin(annotation) is list and (item_type is None or get_args(annotation) == (item_type,))
+
+# Empty value for every synopsis field, used to fill gaps in model output.
+# Read-only; use _empty_synopsis() for a mutable copy.
+_DEFAULT_SYNOPSIS = MappingProxyType({
+    "protocol_title": "",
+    "short_title": "",
+    "protocol_number": "",
+    "version_and_date": "",
+    "study_phase": "",
+    "indication": "",
+    "sponsor": "",
+    "background": "",
+    "mechanism_of_action": "",
+    "justification_for_study_design": "",
+    "primary_objectives": [],
+    "secondary_objectives": [],
+    "exploratory_objectives": [],
+    "primary_endpoints": [],
+    "secondary_endpoints": [],
+    "exploratory_endpoints": [],
+    "design": "",
+    "arms": [],
+    "blinding": "",
+    "randomization": "",
+    "study_duration": "",
+    "target_population": "",
+    "sample_size": 0,
+    "inclusion_criteria": [],
+    "exclusion_criteria": [],
+    "investigational_product": "",
+    "comparator": "",
+    "dosage_and_administration": [],
+    "efficacy_assessments": [],
+    "safety_assessments": [],
+    "pharmacokinetic_assessments": [],
+    "immunogenicity_markers": [],
+    "sample_size_justification": "",
+    "statistical_analysis_plan": "",
+    "interim_analysis": "",
+    "ethical_considerations": "",
+    "data_monitoring": "",
+    "estimated_study_start_date": "",
+    "estimated_study_completion_date": "",
+    "follow_up_duration": ""
+})
+
+# Derived from the schema so the two can't drift apart
+_ARRAY_FIELDS = frozenset(
+    name for name, field in ProtocolSynopsis.model_fields.items()
+    if _is_list_annotation(field.annotation)
+)
+
+# Lists of plain strings, deduplicated once after all chunks are merged
+_STRING_LIST_FIELDS = frozenset(
+    name for name, field in ProtocolSynopsis.model_fields.items()
+    if _is_list_annotation(field.annotation, str)
+)
+
+# Single-valued fields; merging keeps the first non-empty value seen
+_SCALAR_FIELDS = frozenset(ProtocolSynopsis.model_fields) - _ARRAY_FIELDS
+
+# Non-optional list fields, expected to be populated for every protocol
+_CORE_ARRAY_FIELDS = frozenset(
+    name for name, field in ProtocolSynopsis.model_fields.items()
+    if get_origin(field.annotation) is list
+)
+
+# Required scalar fields that SYSTEM_PROMPT still allows to be left empty
+_MAY_BE_EMPTY_FIELDS = frozenset({"short_title", "randomization"})
 
-    def _chunk_text(self, text: str, max_chunk_size: int = 100000) -> List[str]:
-        """Split text into chunks respecting sentence boundaries.
-        Using larger chunk size for GPT-4o-mini's 128k token window."""
+# Scalar fields expected to be filled for every protocol; early exit waits for these
+_CORE_SCALAR_FIELDS = frozenset(
+    name for name, field in ProtocolSynopsis.model_fields.items()
+    if name in _SCALAR_FIELDS and field.is_required()
+) - _MAY_BE_EMPTY_FIELDS
+
+def _empty_synopsis() -> Dict:
+    """Return a fresh copy of _DEFAULT_SYNOPSIS with its own empty lists."""
+    return {key: list(value) if isinstance(value, list) else value
+            for key, value in _DEFAULT_SYNOPSIS.items()}
+
+class RateLimiter:
+    """Dual token bucket limiting requests and tokens per minute.
+
+    Both buckets start full and refill continuously at their per-minute rate.
+    All chunk tasks share one limiter and await `acquire` before each request.
+    """
+
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = float(max_requests_per_minute)
+        self.available_token_capacity = float(max_tokens_per_minute)
+        self._last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self.available_request_capacity = min(
+            self.max_requests_per_minute,
+            self.available_request_capacity + elapsed * self.max_requests_per_minute / 60,
+        )
+        self.available_token_capacity = min(
+            self.max_tokens_per_minute,
+            self.available_token_capacity + elapsed * self.max_tokens_per_minute / 60,
+        )
+
+    async def acquire(self, tokens: int):
+        """Wait until one request and `tokens` tokens are available, then consume them."""
+        # A single request larger than the whole bucket can only wait for a full bucket
+        tokens = min(tokens, self.max_tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= tokens
+                    return
+                wait = max(
+                    (1 - self.available_request_capacity) * 60 / self.max_requests_per_minute,
+                    (tokens - self.available_token_capacity) * 60 / self.max_tokens_per_minute,
+                )
+                await asyncio.sleep(wait)
+
+class ResponseCache:
+    """SQLite-backed cache of parsed model responses with a time-to-live."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, result BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        # Expired rows are never read again, so drop them to keep the file from growing
+        self._conn.execute("DELETE FROM responses WHERE created_at <= ?",
+                           (time.time() - self.ttl_seconds,))
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(chunks: List[str]) -> str:
+        """Key a response by everything that determines it: model, prompt, schema and chunks."""
+        key_text = MODEL + SYSTEM_PROMPT + USER_TEMPLATE + _RESPONSE_SCHEMA + "\0".join(chunks)
+        return hashlib.sha256(key_text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        row = self._conn.execute(
+            "SELECT result FROM responses WHERE key = ? AND created_at > ?",
+            (key, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, result: List[Dict]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, result, created_at) VALUES (?, ?, ?)",
+            (key, orjson.dumps(result), time.time())
+        )
+        self._conn.commit()
+
+def cache_response(process_batch):
+    """Serve `_process_batch` results from the generator's response cache when enabled."""
+    @wraps(process_batch)
+    async def wrapper(self, run: "_RunState", chunks: List[str], first_chunk_num: int) -> List[Dict]:
+        if self.response_cache is None:
+            return await process_batch(self, run, chunks, first_chunk_num)
+        key = ResponseCache.make_key(chunks)
+        result = self.response_cache.get(key)
+        if result is not None:
+            logger.info("Using cached response for chunks %d-%d",
+                        first_chunk_num, first_chunk_num + len(chunks) - 1)
+            return result
+        result = await process_batch(self, run, chunks, first_chunk_num)
+        # A response with the wrong number of extractions is used for this run
+        # but not cached, so a rerun asks the model again
+        if len(result) == len(chunks):
+            self.response_cache.set(key, result)
+        return result
+    return wrapper
+
+class _RunState:
+    """State of a single generate_synopsis_async run, kept off the generator so
+    concurrent runs don't share a client, rate limiter or merge state."""
+
+    def __init__(self, client: AsyncOpenAI):
+        self.client = client
+        # Created on the first request of the run that misses the response cache
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.rate_limiter_lock = asyncio.Lock()
+        # Content hashes of the merged arms and dosage_and_administration items
+        self.dict_list_seen: Dict[str, set] = defaultdict(set)
+        self.filled: set = set()  # Scalar fields that already have their final value
+
+# pypdf fallback: each worker process opens its own reader, since a PdfReader
+# reads pages lazily through a single shared file handle
+_worker_reader = None
+
+def _init_page_reader(pdf_path: str):
+    global _worker_reader
+    _worker_reader = PdfReader(pdf_path)
+
+def _extract_page_text(page_num: int) -> str:
+    return _worker_reader.pages[page_num].extract_text() or ""
+
+class ProtocolSynopsisGenerator:
+    def __init__(self, max_concurrent: int = 8, max_retries: int = 5,
+                 max_requests_per_minute: Optional[int] = None,
+                 max_tokens_per_minute: Optional[int] = None,
+                 use_cache: bool = True,
+                 max_chunk_tokens: Optional[int] = None,
+                 max_chunks_per_request: int = DEFAULT_MAX_CHUNKS_PER_REQUEST,
+                 early_exit: bool = False):
+        """
+        Args:
+            max_concurrent: Maximum number of chunk requests in flight at once.
+            max_retries: Retries per request on rate-limit, timeout, connection and server errors.
+            max_requests_per_minute: Request rate limit. Probed from the API if omitted.
+            max_tokens_per_minute: Token rate limit. Probed from the API if omitted.
+            use_cache: Reuse cached responses for chunks that were processed before.
+            max_chunk_tokens: Size of the chunks oversized protocols are split into.
+                Defaults to the most protocol text that fits in a single request.
+            max_chunks_per_request: Most chunks packed into one request when they are
+                small enough to share it.
+            early_exit: Cancel outstanding requests once every required field has a value. Faster
+                and cheaper for long protocols, but list fields such as inclusion
+                criteria may miss items that only appear in later chunks.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.response_cache = ResponseCache() if use_cache else None
+        if max_chunk_tokens is not None and max_chunk_tokens <= CHUNK_OVERLAP_TOKENS:
+            raise ValueError(f"max_chunk_tokens must exceed the {CHUNK_OVERLAP_TOKENS}-token chunk overlap")
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_chunks_per_request = max_chunks_per_request
+        self.early_exit = early_exit
+
+    def _iter_page_text(self, pdf_path: str) -> Iterator[str]:
+        """Yield the text of each PDF page as it is extracted, using PDFium when available."""
         try:
-            sentences = text.replace('\n', ' ').split('. ')
-            chunks = []
-            current_chunk = []
-            current_size = 0
-            
-            for sentence in sentences:
-                sentence_size = len(sentence)
-                if current_size + sentence_size > max_chunk_size:
-                    chunks.append('. '.join(current_chunk) + '.')
-                    current_chunk = [sentence]
-                    current_size = sentence_size
+            if pdfium is None:
+                reader = PdfReader(pdf_path)
+                n_pages = len(reader.pages)
+                workers = min(32, os.cpu_count() or 1, n_pages)
+                if workers <= 1:
+                    for page in reader.pages:
+                        yield page.extract_text() or ""
                 else:
-                    current_chunk.append(sentence)
-                    current_size += sentence_size
-            
-            if current_chunk:
-                chunks.append('. '.join(current_chunk) + '.')
-            
-            logger.info(f"Text split into {len(chunks)} chunks")
-            return chunks
+                    # pypdf extraction is pure Python and holds the GIL, so pages are
+                    # spread across processes; map still yields them in page order.
+                    # Workers are spawned, since forking a process that is running
+                    # the event loop and executor threads can deadlock.
+                    with ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_page_reader,
+                                             initargs=(pdf_path,)) as executor:
+                        yield from executor.map(_extract_page_text, range(n_pages), chunksize=4)
+                logger.info("Successfully read PDF with %d pages", n_pages)
+                return
+
+            # PDFium is not thread-safe, so pages are extracted one at a time
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    yield textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                logger.info("Successfully read PDF with %d pages", len(pdf))
+            finally:
+                pdf.close()
         except Exception as e:
-            logger.error(f"Error chunking text: {str(e)}")
+            logger.error("Error reading PDF file: %s", e)
             raise
 
-    def _process_chunk(self, chunk: str, chunk_num: int, total_chunks: int) -> Dict:
-        """Process a single chunk of text using GPT-4o-mini."""
+    def _iter_chunks(self, pages: Iterable[str]) -> Iterator[str]:
+        """Split the page stream into chunks of exactly max_chunk_tokens tokens (the
+        last may be shorter), each overlapping the previous by CHUNK_OVERLAP_TOKENS.
+        Chunks are yielded as soon as they fill, so only one is held in memory."""
+        encoding = _get_encoding()
+        max_chunk_tokens = self.max_chunk_tokens or _input_token_budget()
+        stride = max_chunk_tokens - CHUNK_OVERLAP_TOKENS
+        pending_tokens = []
+        new_tokens = 0  # Tokens not yet sent in any chunk
+        for page in pages:
+            if not page.strip():
+                continue  # Pages with no text layer, e.g. scans, would only add whitespace
+            page_tokens = encoding.encode(page + "\n")
+            pending_tokens.extend(page_tokens)
+            new_tokens += len(page_tokens)
+            while len(pending_tokens) >= max_chunk_tokens:
+                yield encoding.decode(pending_tokens[:max_chunk_tokens])
+                del pending_tokens[:stride]
+                new_tokens = len(pending_tokens) - CHUNK_OVERLAP_TOKENS
+        if new_tokens > 0:
+            yield encoding.decode(pending_tokens)
+
+    def _iter_batches(self, chunks: Iterable[str]) -> Iterator[List[str]]:
+        """Group consecutive chunks into batches that share a single request.
+        A batch holds at most max_chunks_per_request chunks and _input_token_budget() tokens."""
+        budget = _input_token_budget()
+        current_batch = []
+        current_size = 0
+        for chunk in chunks:
+            chunk_size = count_tokens(chunk)
+            if current_batch and (current_size + chunk_size > budget
+                                  or len(current_batch) == self.max_chunks_per_request):
+                yield current_batch
+                current_batch = []
+                current_size = 0
+            current_batch.append(chunk)
+            current_size += chunk_size
+        if current_batch:
+            yield current_batch
+
+    async def _probe_rate_limits(self, client: AsyncOpenAI) -> RateLimiter:
+        """Read the account's rate limits from the headers of a 1-token completion.
+        Explicitly configured limits take precedence over probed ones."""
+        rpm, tpm = self.max_requests_per_minute, self.max_tokens_per_minute
+        if rpm is None or tpm is None:
+            try:
+                raw = await client.chat.completions.with_raw_response.create(
+                    model=MODEL,
+                    messages=[{"role": "user", "content": "ping"}],
+                    max_tokens=1
+                )
+                rpm = rpm or int(raw.headers.get("x-ratelimit-limit-requests", 0)) or None
+                tpm = tpm or int(raw.headers.get("x-ratelimit-limit-tokens", 0)) or None
+            except Exception as e:
+                logger.warning("Could not probe rate limits, using defaults: %s", e)
+        rpm = rpm or DEFAULT_MAX_REQUESTS_PER_MINUTE
+        tpm = tpm or DEFAULT_MAX_TOKENS_PER_MINUTE
+        logger.info("Rate limits: %d requests/min, %d tokens/min", rpm, tpm)
+        return RateLimiter(rpm, tpm)
+
+    async def _get_rate_limiter(self, run: _RunState) -> RateLimiter:
+        """Return the run's rate limiter, probing the limits on first use so
+        runs served entirely from the response cache make no API calls."""
+        async with run.rate_limiter_lock:
+            if run.rate_limiter is None:
+                run.rate_limiter = await self._probe_rate_limits(run.client)
+        return run.rate_limiter
+
+    async def _create_completion(self, run: _RunState, **kwargs):
+        """Call the chat completions API with a structured-output response format,
+        retrying with exponential backoff on transient errors."""
+        # Budget for the full prompt plus the largest possible completion
+        estimated_tokens = kwargs.get("max_tokens", 0) + sum(
+            _system_prompt_tokens() if message is SYSTEM_MSG[0] else count_tokens(message["content"])
+            for message in kwargs["messages"]
+        )
+        rate_limiter = await self._get_rate_limiter(run)
+        for attempt in range(self.max_retries + 1):
+            try:
+                await rate_limiter.acquire(estimated_tokens)
+                return await run.client.beta.chat.completions.parse(**kwargs)
+            except (APIConnectionError, APIStatusError) as e:
+                # The same failures the SDK's own retries cover: connection errors and
+                # timeouts, and 408, 409, 429 and 5xx responses
+                retryable = (not isinstance(e, APIStatusError)
+                             or e.status_code in (408, 409, 429) or e.status_code >= 500)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning("%s from API, retrying in %.1fs (attempt %d/%d)",
+                               type(e).__name__, delay, attempt + 1, self.max_retries)
+                await asyncio.sleep(delay)
+
+    @cache_response
+    async def _process_batch(self, run: _RunState, chunks: List[str], first_chunk_num: int) -> List[Dict]:
+        """Process a batch of chunks in a single GPT-4o-mini request, returning
+        one extraction per chunk."""
+        last_chunk_num = first_chunk_num + len(chunks) - 1
         try:
-            system_prompt = """You are a clinical research expert tasked with extracting key information from a clinical trial protocol to create a synopsis.
-            The input text is a section of a larger protocol document. Extract relevant information following ICH guidelines.
-            Focus on maintaining technical accuracy and precision. Return the information in a JSON format exactly matching the provided schema.
-            
-            Required JSON Schema:
-            {
-                "protocol_title": "string",
-                "short_title": "string",
-                "protocol_number": "string",
-                "version_and_date": "string",
-                "study_phase": "string",
-                "indication": "string",
-                "sponsor": "string",
-                "background": "string",
-                "mechanism_of_action": "string",
-                "justification_for_study_design": "string",
-                "primary_objectives": ["string"],
-                "secondary_objectives": ["string"],
-                "exploratory_objectives": ["string"],
-                "primary_endpoints": ["string"],
-                "secondary_endpoints": ["string"],
-                "exploratory_endpoints": ["string"],
-                "design": "string",
-                "arms": [
-                    {
-                        "arm_name": "string",
-                        "treatment_description": "string",
-                        "dosing_schedule": "string"
-                    }
-                ],
-                "blinding": "string",
-                "randomization": "string",
-                "study_duration": "string",
-                "target_population": "string",
-                "sample_size": 0,
-                "inclusion_criteria": ["string"],
-                "exclusion_criteria": ["string"],
-                "investigational_product": "string",
-                "comparator": "string",
-                "dosage_and_administration": [
-                    {
-                        "drug_name": "string",
-                        "dose": "string",
-                        "frequency": "string",
-                        "route_of_administration": "string"
-                    }
-                ],
-                "efficacy_assessments": ["string"],
-                "safety_assessments": ["string"],
-                "pharmacokinetic_assessments": ["string"],
-                "immunogenicity_markers": ["string"],
-                "sample_size_justification": "string",
-                "statistical_analysis_plan": "string",
-                "interim_analysis": "string",
-                "ethical_considerations": "string",
-                "data_monitoring": "string",
-                "estimated_study_start_date": "string",
-                "estimated_study_completion_date": "string",
-                "follow_up_duration": "string"
-            }
-            
-            IMPORTANT: You must include ALL fields in your response, even if empty.
-            - Use empty string "" for missing string fields
-            - Use empty array [] for missing array fields (NEVER use empty string for array fields)
-            - Use 0 for missing numeric fields
-            For sponsor information, extract only the name as a string, not the full details."""
-
-            user_prompt = f"""Process part {chunk_num}/{total_chunks} of the protocol document.
-            Extract all relevant information into a structured format following ICH guidelines and the exact schema provided.
-            You MUST include ALL fields in the output JSON, even if empty.
-            IMPORTANT: Array fields must always be arrays, even if empty (use [] not "").
-            
-            Text to process:
-            {chunk}
-            
-            Return ONLY a valid JSON object matching the schema exactly. Do not include any other text or explanation."""
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using GPT-4o-mini
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+            tagged_chunks = "\n".join(f"<<<CHUNK {i}>>>\n{chunk}" for i, chunk in enumerate(chunks, 1))
+            user_msg = {"role": "user", "content": USER_TEMPLATE.format(chunks=tagged_chunks)}
+
+            response = await self._create_completion(
+                run,
+                model=MODEL,
+                messages=[*SYSTEM_MSG, user_msg],
                 temperature=0.1,
-                max_tokens=16384,  # GPT-4o-mini's max output tokens
-                response_format={ "type": "json_object" }  # Ensure JSON output
+                max_tokens=MAX_OUTPUT_TOKENS,
+                response_format=ChunkExtractions  # Schema enforced server-side
             )
 
-            result = response.choices[0].message.content
-            logger.info(f"Successfully processed chunk {chunk_num}/{total_chunks}")
-            logger.debug(f"Raw response from model: {result}")
+            message = response.choices[0].message
+            if message.refusal:
+                raise ValueError(f"Model refused to process chunks: {message.refusal}")
+            result = message.content
+            logger.info("Successfully processed chunks %d-%d", first_chunk_num, last_chunk_num)
+            usage = response.usage
+            if usage and usage.prompt_tokens_details:
+                # Confirms the SYSTEM_PROMPT prefix is being served from the prompt cache
+                logger.info("Chunks %d-%d: %d/%d prompt tokens cached", first_chunk_num, last_chunk_num,
+                            usage.prompt_tokens_details.cached_tokens or 0, usage.prompt_tokens)
+            logger.debug("Raw response from model: %s", result)
             
-            try:
-                parsed_result = json.loads(result)
-                # Ensure all required fields are present with default values if missing
-                default_structure = {
-                    "protocol_title": "",
-                    "short_title": "",
-                    "protocol_number": "",
-                    "version_and_date": "",
-                    "study_phase": "",
-                    "indication": "",
-                    "sponsor": "",
-                    "background": "",
-                    "mechanism_of_action": "",
-                    "justification_for_study_design": "",
-                    "primary_objectives": [],
-                    "secondary_objectives": [],
-                    "exploratory_objectives": [],
-                    "primary_endpoints": [],
-                    "secondary_endpoints": [],
-                    "exploratory_endpoints": [],
-                    "design": "",
-                    "arms": [],
-                    "blinding": "",
-                    "randomization": "",
-                    "study_duration": "",
-                    "target_population": "",
-                    "sample_size": 0,
-                    "inclusion_criteria": [],
-                    "exclusion_criteria": [],
-                    "investigational_product": "",
-                    "comparator": "",
-                    "dosage_and_administration": [],
-                    "efficacy_assessments": [],
-                    "safety_assessments": [],
-                    "pharmacokinetic_assessments": [],
-                    "immunogenicity_markers": [],
-                    "sample_size_justification": "",
-                    "statistical_analysis_plan": "",
-                    "interim_analysis": "",
-                    "ethical_considerations": "",
-                    "data_monitoring": "",
-                    "estimated_study_start_date": "",
-                    "estimated_study_completion_date": "",
-                    "follow_up_duration": ""
-                }
-
-                # Ensure all array fields are actually arrays
-                array_fields = [
-                    "primary_objectives", "secondary_objectives", "exploratory_objectives",
-                    "primary_endpoints", "secondary_endpoints", "exploratory_endpoints",
-                    "arms", "inclusion_criteria", "exclusion_criteria",
-                    "dosage_and_administration", "efficacy_assessments", "safety_assessments",
-                    "pharmacokinetic_assessments", "immunogenicity_markers"
-                ]
-                
-                # Update default structure with parsed results
-                for key, value in parsed_result.items():
-                    if key in array_fields and not isinstance(value, list):
-                        if value:  # If there's a value but it's not a list
-                            default_structure[key] = [value]
-                        else:  # If it's empty or null
-                            default_structure[key] = []
-                    else:
-                        default_structure[key] = value
-                
-                return default_structure
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON response: {result}")
+            extractions = message.parsed.extractions
+            if len(extractions) != len(chunks):
+                logger.warning("Expected %d extractions for chunks %d-%d, got %d",
+                               len(chunks), first_chunk_num, last_chunk_num, len(extractions))
+            return [extraction.model_dump() for extraction in extractions]
+
+        except LengthFinishReasonError:
+            # The extractions outgrew MAX_OUTPUT_TOKENS; retry the two halves of the
+            # batch as concurrent requests. A single chunk can't be split any further.
+            if len(chunks) == 1:
+                logger.error("Output for chunk %d exceeded %d tokens", first_chunk_num, MAX_OUTPUT_TOKENS)
                 raise
-                
+            mid = len(chunks) // 2
+            logger.warning("Output for chunks %d-%d was truncated, splitting into two requests",
+                           first_chunk_num, last_chunk_num)
+            first_half, second_half = await asyncio.gather(
+                self._process_batch(run, chunks[:mid], first_chunk_num),
+                self._process_batch(run, chunks[mid:], first_chunk_num + mid),
+            )
+            return first_half + second_half
         except Exception as e:
-            logger.error(f"Error processing chunk {chunk_num}: {str(e)}")
+            logger.error("Error processing chunks %d-%d: %s", first_chunk_num, last_chunk_num, e)
             raise
 
-    def _merge_info(self, base: dict, new: dict):
-        """Merge new information into base dict."""
+    def done_scalars(self, run: _RunState) -> bool:
+        """True once every core scalar field has been filled by a merged chunk.
+        Optional fields such as comparator are not waited for, since many
+        protocols have none."""
+        return run.filled >= _CORE_SCALAR_FIELDS
+
+    def _done_lists(self, base: dict) -> bool:
+        return all(base.get(key) for key in _CORE_ARRAY_FIELDS)
+
+    def _merge_info(self, run: _RunState, base: dict, new: dict):
+        """Merge new information into base dict.
+
+        String lists are only extended here; call _finalize once all chunks
+        are merged to deduplicate them."""
         if not base:
             # Initialize base with empty values for all fields
-            base = {
-                "protocol_title": "",
-                "short_title": "",
-                "protocol_number": "",
-                "version_and_date": "",
-                "study_phase": "",
-                "indication": "",
-                "sponsor": "",
-                "background": "",
-                "mechanism_of_action": "",
-                "justification_for_study_design": "",
-                "primary_objectives": [],
-                "secondary_objectives": [],
-                "exploratory_objectives": [],
-                "primary_endpoints": [],
-                "secondary_endpoints": [],
-                "exploratory_endpoints": [],
-                "design": "",
-                "arms": [],
-                "blinding": "",
-                "randomization": "",
-                "study_duration": "",
-                "target_population": "",
-                "sample_size": 0,
-                "inclusion_criteria": [],
-                "exclusion_criteria": [],
-                "investigational_product": "",
-                "comparator": "",
-                "dosage_and_administration": [],
-                "efficacy_assessments": [],
-                "safety_assessments": [],
-                "pharmacokinetic_assessments": [],
-                "immunogenicity_markers": [],
-                "sample_size_justification": "",
-                "statistical_analysis_plan": "",
-                "interim_analysis": "",
-                "ethical_considerations": "",
-                "data_monitoring": "",
-                "estimated_study_start_date": "",
-                "estimated_study_completion_date": "",
-                "follow_up_duration": ""
-            }
+            base.update(_empty_synopsis())
         
         for key, value in new.items():
+            if key in run.filled:  # Already saturated by an earlier chunk
+                continue
             if key not in base:
                 base[key] = value
             elif isinstance(value, list):
@@ -364,224 +683,175 @@ class ProtocolSynopsisGenerator:
                     base[key] = []
                 if value:  # Only process non-empty lists
                     if isinstance(value[0], dict):  # Handle lists of dictionaries (arms, dosage_and_administration)
-                        # Merge based on content rather than direct comparison
+                        # Dedup on a short hash of canonical JSON so items are compared
+                        # by content in O(1) without keeping a serialized copy of each
+                        seen = run.dict_list_seen[key]
                         for new_item in value:
-                            if new_item not in base[key]:  # This works because dictionaries are compared by content
+                            item_key = hashlib.blake2b(orjson.dumps(new_item, option=orjson.OPT_SORT_KEYS),
+                                                       digest_size=16).digest()
+                            if item_key not in seen:
+                                seen.add(item_key)
                                 base[key].append(new_item)
                     else:  # Handle lists of strings
                         base[key].extend(value)
-                        base[key] = list(set(base[key]))  # Remove duplicates for string lists
             elif isinstance(value, str) and value and (not base[key]):
                 base[key] = value
+                run.filled.add(key)
             elif isinstance(value, (int, float)) and value and (not base[key]):
                 base[key] = value
+                run.filled.add(key)
+
+    def _finalize(self, base: dict):
+        """Deduplicate the string lists in base in a single pass, keeping
+        first-seen order so repeated runs give identical output."""
+        for key in _STRING_LIST_FIELDS & base.keys():
+            base[key] = list(dict.fromkeys(base[key]))
+
+    async def _merger(self, run: _RunState, queue: asyncio.Queue, base: dict):
+        """Merge finished batches from the queue into base in submission order.
+
+        Queue items are (index, task) pairs, with a final (None, total) marking
+        the number of batches. Batches that finish ahead of an earlier one are
+        held back until it arrives, so merging overlaps with outstanding requests
+        but the result doesn't depend on completion order. Returns early once
+        every field is filled if early_exit is set."""
+        finished = {}
+        next_index = 0
+        total = None
+        while total is None or next_index < total:
+            index, item = await queue.get()
+            if index is None:
+                total = item
+                continue
+            finished[index] = item
+            while next_index in finished:
+                for chunk_info in finished.pop(next_index).result():
+                    self._merge_info(run, base, chunk_info)
+                next_index += 1
+                if self.early_exit and self.done_scalars(run) and self._done_lists(base):
+                    logger.info("All fields filled after %d requests, cancelling the rest", next_index)
+                    return
 
     def generate_synopsis(self, pdf_path: str) -> ProtocolSynopsis:
         """Generate a protocol synopsis from a PDF protocol document."""
+        return asyncio.run(self.generate_synopsis_async(pdf_path))
+
+    async def generate_synopsis_async(self, pdf_path: str) -> ProtocolSynopsis:
+        """Generate a protocol synopsis, processing all chunks concurrently."""
         try:
-            logger.info(f"Starting synopsis generation for {pdf_path}")
-            
-            # Read PDF
-            full_text = self._read_pdf(pdf_path)
-            chunks = self._chunk_text(full_text)
+            # SDK retries are disabled so _create_completion's backoff loop is the only one
+            # The client's pooled connections are bound to the event loop, and
+            # generate_synopsis starts a new loop on every call, so each run opens its own
+            run = _RunState(AsyncOpenAI(max_retries=0))
+            logger.info("OpenAI client initialized successfully")
+        except Exception as e:
+            logger.error("Error initializing OpenAI client: %s", e)
+            raise
+        try:
+            logger.info("Starting synopsis generation for %s", pdf_path)
             
-            # Process each chunk
-            extracted_info = None  # Start with None to ensure proper initialization
-            for i, chunk in enumerate(chunks, 1):
-                chunk_info = self._process_chunk(chunk, i, len(chunks))
-                if extracted_info is None:
-                    extracted_info = chunk_info
+            # Process all batches concurrently, capped at max_concurrent in flight
+            # and throttled to stay under the account's rate limits
+            semaphore = asyncio.Semaphore(self.max_concurrent)
+
+            async def process(batch: List[str], first_chunk_num: int) -> List[Dict]:
+                # The slot was acquired by the submission loop before parsing the batch
+                try:
+                    return await self._process_batch(run, batch, first_chunk_num)
+                finally:
+                    semaphore.release()
+
+            # Stream pages into chunks and chunks into batches. Most protocols fit in
+            # a single chunk; larger ones are split, and small chunks share a request.
+            # Each batch is submitted as soon as it is ready, so API calls run while
+            # the rest of the PDF is still being parsed. Parsing waits for a free
+            # slot first, so at most max_concurrent batches of text are held at once.
+            # Finished batches are merged by a background task as they complete
+            extracted_info = {}
+            queue = asyncio.Queue()
+            merger = asyncio.create_task(self._merger(run, queue, extracted_info))
+
+            batches = self._iter_batches(self._iter_chunks(self._iter_page_text(pdf_path)))
+            loop = asyncio.get_running_loop()
+            tasks = []
+            first_chunk_num = 1
+            try:
+                # Stop submitting if the merger is done early (early exit or a failed batch)
+                while not merger.done():
+                    await semaphore.acquire()
+                    # Parse off the event loop so in-flight requests keep progressing
+                    batch = await loop.run_in_executor(None, next, batches, None)
+                    if batch is None:
+                        semaphore.release()
+                        break
+                    task = asyncio.create_task(process(batch, first_chunk_num))
+                    task.add_done_callback(lambda t, index=len(tasks): queue.put_nowait((index, t)))
+                    tasks.append(task)
+                    first_chunk_num += len(batch)
                 else:
-                    self._merge_info(extracted_info, chunk_info)
+                    # Merger stopped before the whole PDF was read. Closing may wait
+                    # for the pypdf worker pool to shut down, so it runs off the loop.
+                    await loop.run_in_executor(None, batches.close)
+                if not tasks:
+                    raise ValueError(f"No text could be extracted from {pdf_path}")
+                if not merger.done():
+                    logger.info("Protocol split into %d chunks across %d requests",
+                                first_chunk_num - 1, len(tasks))
+                queue.put_nowait((None, len(tasks)))
+                await merger
+            finally:
+                # Stops outstanding requests after an early exit or an error
+                merger.cancel()
+                for task in tasks:
+                    task.cancel()
+            self._finalize(extracted_info)
 
             logger.info("Successfully generated synopsis")
-            logger.debug(f"Final extracted info: {json.dumps(extracted_info, indent=2)}")
-            return ProtocolSynopsis(**extracted_info)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Final extracted info: %s",
+                             orjson.dumps(extracted_info, option=orjson.OPT_INDENT_2).decode())
+            return ProtocolSynopsis.model_validate(extracted_info)
             
         except Exception as e:
-            logger.error(f"Error generating synopsis: {str(e)}")
+            logger.error("Error generating synopsis: %s", e)
             raise
+        finally:
+            await run.client.close()
 
 def save_to_word(synopsis: ProtocolSynopsis, output_path: str = None):
-    """Save the synopsis to a formatted Word document."""
-    doc = Document()
-    
-    # Set up document style
-    style = doc.styles['Normal']
-    style.font.name = 'Arial'
-    style.font.size = Pt(11)
-    
-    # Title
-    title = doc.add_heading('PROTOCOL SYNOPSIS', 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
-    # Basic Study Information
-    doc.add_heading('Basic Study Information', 1)
-    doc.add_paragraph(f'Protocol Title: {synopsis.protocol_title}')
-    doc.add_paragraph(f'Short Title: {synopsis.short_title}')
-    doc.add_paragraph(f'Protocol Number: {synopsis.protocol_number}')
-    doc.add_paragraph(f'Version and Date: {synopsis.version_and_date}')
-    doc.add_paragraph(f'Study Phase: {synopsis.study_phase}')
-    doc.add_paragraph(f'Indication: {synopsis.indication}')
-    doc.add_paragraph(f'Sponsor: {synopsis.sponsor}')
-    
-    # Study Rationale
-    doc.add_heading('Study Rationale', 1)
-    doc.add_paragraph('Background:', style='Heading 2')
-    doc.add_paragraph(synopsis.background)
-    doc.add_paragraph('Mechanism of Action:', style='Heading 2')
-    doc.add_paragraph(synopsis.mechanism_of_action)
-    doc.add_paragraph('Justification for Study Design:', style='Heading 2')
-    doc.add_paragraph(synopsis.justification_for_study_design)
-    
-    # Objectives & Endpoints
-    doc.add_heading('Objectives & Endpoints', 1)
-    
-    doc.add_paragraph('Primary Objectives:', style='Heading 2')
-    for obj in synopsis.primary_objectives:
-        doc.add_paragraph(obj, style='List Bullet')
-    
-    doc.add_paragraph('Secondary Objectives:', style='Heading 2')
-    for obj in synopsis.secondary_objectives:
-        doc.add_paragraph(obj, style='List Bullet')
-    
-    if synopsis.exploratory_objectives:
-        doc.add_paragraph('Exploratory Objectives:', style='Heading 2')
-        for obj in synopsis.exploratory_objectives:
-            doc.add_paragraph(obj, style='List Bullet')
-    
-    doc.add_paragraph('Primary Endpoints:', style='Heading 2')
-    for endpoint in synopsis.primary_endpoints:
-        doc.add_paragraph(endpoint, style='List Bullet')
-    
-    doc.add_paragraph('Secondary Endpoints:', style='Heading 2')
-    for endpoint in synopsis.secondary_endpoints:
-        doc.add_paragraph(endpoint, style='List Bullet')
-    
-    if synopsis.exploratory_endpoints:
-        doc.add_paragraph('Exploratory Endpoints:', style='Heading 2')
-        for endpoint in synopsis.exploratory_endpoints:
-            doc.add_paragraph(endpoint, style='List Bullet')
-    
-    # Study Design
-    doc.add_heading('Study Design', 1)
-    doc.add_paragraph(f'Design: {synopsis.design}')
-    doc.add_paragraph(f'Blinding: {synopsis.blinding}')
-    doc.add_paragraph(f'Randomization: {synopsis.randomization}')
-    doc.add_paragraph(f'Study Duration: {synopsis.study_duration}')
-    
-    doc.add_paragraph('Study Arms:', style='Heading 2')
-    table = doc.add_table(rows=1, cols=3)
-    table.style = 'Table Grid'
-    header_cells = table.rows[0].cells
-    header_cells[0].text = 'Arm Name'
-    header_cells[1].text = 'Treatment Description'
-    header_cells[2].text = 'Dosing Schedule'
-    
-    for arm in synopsis.arms:
-        row_cells = table.add_row().cells
-        row_cells[0].text = arm.arm_name
-        row_cells[1].text = arm.treatment_description
-        row_cells[2].text = arm.dosing_schedule
-    
-    # Population
-    doc.add_heading('Population', 1)
-    doc.add_paragraph(f'Target Population: {synopsis.target_population}')
-    doc.add_paragraph(f'Sample Size: {synopsis.sample_size}')
-    
-    doc.add_paragraph('Inclusion Criteria:', style='Heading 2')
-    for criterion in synopsis.inclusion_criteria:
-        doc.add_paragraph(criterion, style='List Bullet')
-    
-    doc.add_paragraph('Exclusion Criteria:', style='Heading 2')
-    for criterion in synopsis.exclusion_criteria:
-        doc.add_paragraph(criterion, style='List Bullet')
-    
-    # Treatments
-    doc.add_heading('Treatments', 1)
-    doc.add_paragraph(f'Investigational Product: {synopsis.investigational_product}')
-    if synopsis.comparator:
-        doc.add_paragraph(f'Comparator: {synopsis.comparator}')
-    
-    doc.add_paragraph('Dosage and Administration:', style='Heading 2')
-    table = doc.add_table(rows=1, cols=4)
-    table.style = 'Table Grid'
-    header_cells = table.rows[0].cells
-    header_cells[0].text = 'Drug Name'
-    header_cells[1].text = 'Dose'
-    header_cells[2].text = 'Frequency'
-    header_cells[3].text = 'Route of Administration'
-    
-    for dosage in synopsis.dosage_and_administration:
-        row_cells = table.add_row().cells
-        row_cells[0].text = dosage.drug_name
-        row_cells[1].text = dosage.dose
-        row_cells[2].text = dosage.frequency
-        row_cells[3].text = dosage.route_of_administration
-    
-    # Assessments
-    doc.add_heading('Assessments', 1)
-    
-    doc.add_paragraph('Efficacy Assessments:', style='Heading 2')
-    for assessment in synopsis.efficacy_assessments:
-        doc.add_paragraph(assessment, style='List Bullet')
-    
-    doc.add_paragraph('Safety Assessments:', style='Heading 2')
-    for assessment in synopsis.safety_assessments:
-        doc.add_paragraph(assessment, style='List Bullet')
-    
-    if synopsis.pharmacokinetic_assessments:
-        doc.add_paragraph('Pharmacokinetic Assessments:', style='Heading 2')
-        for assessment in synopsis.pharmacokinetic_assessments:
-            doc.add_paragraph(assessment, style='List Bullet')
-    
-    if synopsis.immunogenicity_markers:
-        doc.add_paragraph('Immunogenicity Markers:', style='Heading 2')
-        for marker in synopsis.immunogenicity_markers:
-            doc.add_paragraph(marker, style='List Bullet')
-    
-    # Statistical Considerations
-    doc.add_heading('Statistical Considerations', 1)
-    doc.add_paragraph(f'Sample Size Justification: {synopsis.sample_size_justification}')
-    doc.add_paragraph(f'Statistical Analysis Plan: {synopsis.statistical_analysis_plan}')
-    if synopsis.interim_analysis:
-        doc.add_paragraph(f'Interim Analysis: {synopsis.interim_analysis}')
-    
-    # Ethics & Compliance
-    doc.add_heading('Ethics & Compliance', 1)
-    doc.add_paragraph(f'Ethical Considerations: {synopsis.ethical_considerations}')
-    doc.add_paragraph(f'Data Monitoring: {synopsis.data_monitoring}')
-    
-    # Timeline
-    doc.add_heading('Timeline', 1)
-    if synopsis.estimated_study_start_date:
-        doc.add_paragraph(f'Estimated Study Start Date: {synopsis.estimated_study_start_date}')
-    if synopsis.estimated_study_completion_date:
-        doc.add_paragraph(f'Estimated Study Completion Date: {synopsis.estimated_study_completion_date}')
-    doc.add_paragraph(f'Follow-up Duration: {synopsis.follow_up_duration}')
+    """Save the synopsis to a formatted Word document.
+
+    Renders WORD_TEMPLATE_PATH in a single pass; edit that template to change
+    the layout or styling."""
+    tpl = DocxTemplate(WORD_TEMPLATE_PATH)
+    # Autoescape so characters like < and & in extracted text can't break the XML
+    tpl.render(synopsis.model_dump(), autoescape=True)
     
     # Save the document
     if output_path is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"protocol_synopsis_{timestamp}.docx"
     
-    doc.save(output_path)
+    tpl.save(output_path)
     return output_path
 
 def main():
     import sys
-    if len(sys.argv) != 2:
-        print("Usage: python protocol_synopsis_generator.py <path_to_protocol.pdf>")
-        sys.exit(1)
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a protocol synopsis from a clinical trial protocol PDF.")
+    parser.add_argument("pdf_path", help="path to the protocol PDF")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore cached model responses and always call the API")
+    args = parser.parse_args()
 
     try:
-        generator = ProtocolSynopsisGenerator()
-        synopsis = generator.generate_synopsis(sys.argv[1])
+        generator = ProtocolSynopsisGenerator(use_cache=not args.no_cache)
+        synopsis = generator.generate_synopsis(args.pdf_path)
         
         # Save as JSON
-        json_output = synopsis.model_dump_json(indent=2)
+        json_output = orjson.dumps(synopsis.model_dump(), option=orjson.OPT_INDENT_2)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        with open(f"protocol_synopsis_{timestamp}.json", "w") as f:
+        with open(f"protocol_synopsis_{timestamp}.json", "wb") as f:
             f.write(json_output)
         
         # Save as Word document
@@ -592,7 +862,7 @@ def main():
         print(f"2. Word: {word_path}")
         
     except Exception as e:
-        logger.error(f"Error in main: {str(e)}")
+        logger.error("Error in main: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":